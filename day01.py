@@ -1,4 +1,6 @@
-import re
+import mmap
+from collections import deque
+from dataclasses import dataclass
 from pathlib import Path
 
 import pytest
@@ -23,6 +25,60 @@ def part1(lines):
     return sum(line_digits(line) for line in lines)
 
 
+NOT_DIGITS = bytes(set(range(256)) - set(b'0123456789\n'))
+EDGES = [
+    (value, b'\n' + str(value).encode(), str(value).encode() + b'\n')
+    for value in range(1, 10)
+]
+
+
+def edge_sum(buf):
+    # with everything but digits and newlines deleted, a line's first
+    # digit follows a newline and its last digit precedes one
+    return sum(
+        value * (10 * buf.count(first) + buf.count(last))
+        for value, first, last in EDGES
+    )
+
+
+def part1_bulk(path, chunk_size=1 << 24):
+    path = Path(path)
+    if not path.stat().st_size:
+        return 0
+    total = 0
+    prev = b'\n'
+    with path.open('rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for start in range(0, len(buf), chunk_size):
+            digits = buf[start:start + chunk_size].translate(None, NOT_DIGITS)
+            if not digits:
+                continue
+            total += edge_sum(prev + digits[:1]) + edge_sum(digits)
+            prev = digits[-1:]
+    return total + edge_sum(prev + b'\n')
+
+
+PART1_EXAMPLE = """1abc2
+pqr3stu8vwx
+a1b2c3d4e5f
+treb7uchet"""
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1 << 24])
+@pytest.mark.parametrize("trailer", ["", "\n", "\r\n"])
+def test_part1_bulk(tmp_path, chunk_size, trailer):
+    path = tmp_path / "input.txt"
+    path.write_text(PART1_EXAMPLE + trailer)
+    assert part1_bulk(path, chunk_size) == 142
+    assert part1_bulk(path, chunk_size) == part1(PART1_EXAMPLE.splitlines())
+
+
+def test_part1_bulk_empty(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("")
+    assert part1_bulk(path) == 0
+
+
 if __name__ == '__main__':
     lines = Path("inputs/day01.txt").read_text().splitlines()
     print(part1(lines))
@@ -41,17 +97,68 @@ DIGITS = [
 ]
 
 
+@dataclass(frozen=True)
+class DigitScanner:
+    transitions: list[dict[str, int]]
+    outputs: list[int | None]
+
+    @classmethod
+    def from_words(cls, words):
+        # build the trie, then fold the failure links into a full
+        # transition table (aho-corasick) so scanning never backtracks
+        goto = [{}]
+        outputs = [None]
+        for word, value in words.items():
+            state = 0
+            for c in word:
+                if c not in goto[state]:
+                    goto[state][c] = len(goto)
+                    goto.append({})
+                    outputs.append(None)
+                state = goto[state][c]
+            outputs[state] = value
+
+        transitions = [dict(goto[0])] + [None] * (len(goto) - 1)
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            transitions[state] = {**transitions[fail[state]], **goto[state]}
+            if outputs[state] is None:
+                outputs[state] = outputs[fail[state]]
+            for c, child in goto[state].items():
+                if state:
+                    fail[child] = transitions[fail[state]].get(c, 0)
+                queue.append(child)
+        return cls(transitions, outputs)
+
+    def first(self, chars):
+        # no word contains another, so the first match to end is also
+        # the one that starts first
+        state = 0
+        transitions, outputs = self.transitions, self.outputs
+        for c in chars:
+            state = transitions[state].get(c, 0)
+            if (value := outputs[state]) is not None:
+                return value
+        return None
+
+
+WORDS = {
+    **{str(value): value for value in range(10)},
+    **{digit: value for value, digit in enumerate(DIGITS, 1)},
+}
+FORWARD_SCANNER = DigitScanner.from_words(WORDS)
+BACKWARD_SCANNER = DigitScanner.from_words(
+    {word[::-1]: value for word, value in WORDS.items()}
+)
+
+
 def all_line_digits(line):
-    name_positions = [
-        (m.start(), str(value))
-        for value, digit in enumerate(DIGITS, 1)
-        for m in re.finditer(digit, line)
-    ]
-    number_positions = [
-        (i, str(c)) for i, c in enumerate(line) if c.isdigit()
-    ]
-    positions = sorted(name_positions + number_positions)
-    return int(positions[0][1] + positions[-1][1])
+    first = FORWARD_SCANNER.first(line)
+    if first is None:
+        raise ValueError(line)
+    return first * 10 + BACKWARD_SCANNER.first(reversed(line))
 
 
 INPUT = """two1nine
@@ -73,5 +180,22 @@ def test_all_line_digits_double_world():
     assert all_line_digits("threethree") == 33
 
 
+@pytest.mark.parametrize("line,expected", [
+    ("oneight", 18),
+    ("eighthree", 83),
+    ("twone", 21),
+    ("sevenine", 79),
+    ("0nine", 9),
+    ("fivezero0", 50),
+])
+def test_all_line_digits_overlaps(line, expected):
+    assert all_line_digits(line) == expected
+
+
+def test_all_line_digits_no_digits():
+    with pytest.raises(ValueError):
+        all_line_digits("abc")
+
+
 if __name__ == '__main__':
     print(sum([all_line_digits(line) for line in lines]))
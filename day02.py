@@ -1,6 +1,14 @@
-from functools import reduce
-from operator import mul
+import re
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from itertools import accumulate, compress, product
 from pathlib import Path
+from random import Random
+
+import pytest
+
+CONSTRAINT = {"red": 12, "green": 13, "blue": 14}
 
 
 def parse_reveals(raw_reveals):
@@ -38,8 +46,7 @@ def test_parse_line():
     )
 
 
-def valid_game(reveals):
-    constraint = {"red": 12, "green": 13, "blue": 14}
+def valid_game(reveals, constraint=CONSTRAINT):
     return all(
         all(reveal[color] <= constraint[color] for color in constraint)
         for reveal in reveals
@@ -52,9 +59,81 @@ def test_valid_game():
     assert [gid for (gid, reveals) in games if valid_game(reveals)] == valid
 
 
+GAME_TOKENS = re.compile(r'Game (\d+):|(\d+) (red|green|blue)')
+
+
+def parse_record(line):
+    gid = None
+    red = green = blue = 0
+    for m in GAME_TOKENS.finditer(line):
+        match m.group(3):
+            case None:
+                gid = int(m.group(1))
+            case 'red':
+                red = max(red, int(m.group(2)))
+            case 'green':
+                green = max(green, int(m.group(2)))
+            case 'blue':
+                blue = max(blue, int(m.group(2)))
+    return gid, red, green, blue
+
+
+def test_parse_record():
+    for line in PART1_EXAMPLE:
+        gid, reveals = parse_line(line)
+        minimums = minimum_cubes(reveals)
+        assert parse_record(line) == (
+            gid, minimums["red"], minimums["green"], minimums["blue"]
+        )
+
+
+@dataclass
+class GameTable:
+    ids: array
+    # the maximum red, green and blue counts for each game, three
+    # entries per row
+    cubes: array
+
+    @classmethod
+    def from_lines(cls, lines):
+        ids = array('q')
+        cubes = array('q')
+        for gid, red, green, blue in map(parse_record, lines):
+            ids.append(gid)
+            cubes.extend((red, green, blue))
+        return cls(ids, cubes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self):
+        return zip(self.ids, self.cubes[0::3], self.cubes[1::3],
+                   self.cubes[2::3])
+
+
+def test_game_table():
+    table = GameTable.from_lines(PART1_EXAMPLE)
+    assert len(table) == 5
+    assert list(table.rows()) == [
+        (1, 4, 2, 6),
+        (2, 1, 3, 4),
+        (3, 20, 13, 6),
+        (4, 14, 3, 15),
+        (5, 6, 3, 2),
+    ]
+
+
 def part1(lines):
-    games = [parse_line(line) for line in lines]
-    return sum(gid for (gid, reveals) in games if valid_game(reveals))
+    table = GameTable.from_lines(lines)
+    max_red, max_green, max_blue = CONSTRAINT.values()
+    return sum(
+        gid for gid, red, green, blue in table.rows()
+        if red <= max_red and green <= max_green and blue <= max_blue
+    )
+
+
+def test_part1():
+    assert part1(PART1_EXAMPLE) == 8
 
 
 if __name__ == '__main__':
@@ -82,16 +161,187 @@ def test_minimum_game():
 
 
 def part2(lines):
-    games = [parse_line(line) for line in lines]
-    minimums = [
-        reduce(mul, minimum_cubes(reveal).values(), 1) for (_, reveal) in games
-    ]
-    return sum(minimums)
+    table = GameTable.from_lines(lines)
+    return sum(red * green * blue for _, red, green, blue in table.rows())
 
 
 def test_part2():
     assert part2(PART1_EXAMPLE) == 2286
 
 
+def fit_masks(column, thresholds):
+    # byte i of each mask is 1 when game i fits under the threshold;
+    # one byte per game keeps ANDed masks countable with compress()
+    fits = bytearray(len(column))
+    order = sorted(range(len(column)), key=column.__getitem__)
+    masks = {}
+    i = 0
+    for threshold in sorted(thresholds):
+        while i < len(order) and column[order[i]] <= threshold:
+            fits[order[i]] = 1
+            i += 1
+        masks[threshold] = int.from_bytes(fits, 'little')
+    return masks
+
+
+def evaluate_bags(table, bags, chunk_size=4096):
+    bags = [tuple(bag) for bag in bags]
+    id_sums = [0] * len(bags)
+    power_sums = [0] * len(bags)
+    for start in range(0, len(table), chunk_size):
+        ids = table.ids[start:start + chunk_size]
+        cubes = table.cubes[3 * start:3 * (start + chunk_size)]
+        powers = [
+            red * green * blue
+            for red, green, blue in zip(cubes[0::3], cubes[1::3], cubes[2::3])
+        ]
+        red_masks, green_masks, blue_masks = (
+            fit_masks(cubes[color::3], {bag[color] for bag in bags})
+            for color in range(3)
+        )
+        for i, (red, green, blue) in enumerate(bags):
+            fits = red_masks[red] & green_masks[green] & blue_masks[blue]
+            fits = fits.to_bytes(len(ids), 'little')
+            id_sums[i] += sum(compress(ids, fits))
+            power_sums[i] += sum(compress(powers, fits))
+    return list(zip(id_sums, power_sums))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 4096])
+def test_evaluate_bags(chunk_size):
+    bags = [
+        (12, 13, 14),
+        (100, 100, 100),
+        (0, 0, 0),
+        (4, 3, 6),
+        (20, 13, 6),
+        (14, 3, 15),
+    ]
+    games = [parse_line(line) for line in PART1_EXAMPLE]
+    expected = []
+    for bag in bags:
+        fitting = [
+            (gid, minimum_cubes(reveals)) for gid, reveals in games
+            if valid_game(reveals, dict(zip(("red", "green", "blue"), bag)))
+        ]
+        expected.append((
+            sum(gid for gid, _ in fitting),
+            sum(m["red"] * m["green"] * m["blue"] for _, m in fitting),
+        ))
+    table = GameTable.from_lines(PART1_EXAMPLE)
+    assert evaluate_bags(table, bags, chunk_size) == expected
+    assert expected[0][0] == 8
+    assert expected[1] == (15, 2286)
+
+
+def fenwick_blocks(items):
+    # fenwick node i (1-based) covers items (i - lowbit(i), i], so any
+    # prefix of items is the union of at most log2(len(items)) nodes
+    return [items[i - (i & -i):i] for i in range(1, len(items) + 1)]
+
+
+@dataclass
+class GreenBlueIndex:
+    # the games' green counts, ascending
+    greens: list[int]
+    # for each fenwick node over the green-sorted games: its games' blue
+    # counts, ascending, and the running id sums in that order
+    nodes: list[tuple[list[int], list[int]]]
+
+    @classmethod
+    def from_games(cls, games):
+        games = sorted(games, key=lambda game: game[2])
+        nodes = []
+        for block in fenwick_blocks(games):
+            block = sorted((blue, gid) for gid, _, _, blue in block)
+            nodes.append((
+                [blue for blue, _ in block],
+                list(accumulate((gid for _, gid in block), initial=0)),
+            ))
+        return cls([game[2] for game in games], nodes)
+
+    def query(self, green, blue):
+        count = id_sum = 0
+        i = bisect_right(self.greens, green)
+        while i:
+            blues, id_sums = self.nodes[i - 1]
+            fits = bisect_right(blues, blue)
+            count += fits
+            id_sum += id_sums[fits]
+            i &= i - 1
+        return count, id_sum
+
+
+@dataclass
+class FitIndex:
+    # the games' red counts, ascending
+    reds: list[int]
+    # a green/blue index for each fenwick node over the red-sorted
+    # games, so there are O(n log n) entries at the green level and
+    # O(n log**2 n) at the blue level
+    nodes: list[GreenBlueIndex]
+
+    @classmethod
+    def from_table(cls, table):
+        games = sorted(table.rows(), key=lambda game: game[1])
+        return cls(
+            [game[1] for game in games],
+            [GreenBlueIndex.from_games(block)
+             for block in fenwick_blocks(games)],
+        )
+
+    def query(self, red, green, blue):
+        count = id_sum = 0
+        i = bisect_right(self.reds, red)
+        while i:
+            node_count, node_id_sum = self.nodes[i - 1].query(green, blue)
+            count += node_count
+            id_sum += node_id_sum
+            i &= i - 1
+        return count, id_sum
+
+
+def test_fit_index():
+    table = GameTable.from_lines(PART1_EXAMPLE)
+    index = FitIndex.from_table(table)
+    assert index.query(12, 13, 14) == (3, 8)
+    assert index.query(100, 100, 100) == (5, 15)
+    assert index.query(0, 100, 100) == (0, 0)
+    bags = list(product(range(0, 22, 3), repeat=3))
+    fits = [
+        sum(1 for _, red, green, blue in table.rows()
+            if red <= r and green <= g and blue <= b)
+        for r, g, b in bags
+    ]
+    expected = [
+        (count, id_sum)
+        for count, (id_sum, _) in zip(fits, evaluate_bags(table, bags))
+    ]
+    assert [index.query(*bag) for bag in bags] == expected
+
+
+def test_fit_index_many_distinct_counts():
+    rng = Random(11)
+    size = 2000
+    cubes = array('q', (rng.randrange(10**6) for _ in range(3 * size)))
+    table = GameTable(array('q', range(1, size + 1)), cubes)
+    index = FitIndex.from_table(table)
+    bags = [
+        tuple(rng.randrange(-1, 10**6 + 1) for _ in range(3))
+        for _ in range(200)
+    ] + [(10**6, 10**6, 10**6), (-1, 10**6, 10**6)]
+    fits = [
+        sum(1 for _, red, green, blue in table.rows()
+            if red <= r and green <= g and blue <= b)
+        for r, g, b in bags
+    ]
+    expected = [
+        (count, id_sum)
+        for count, (id_sum, _) in zip(fits, evaluate_bags(table, bags))
+    ]
+    assert [index.query(*bag) for bag in bags] == expected
+    assert index.query(10**6, 10**6, 10**6) == (size, size * (size + 1) // 2)
+
+
 if __name__ == '__main__':
     print(part2(lines))
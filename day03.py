@@ -1,7 +1,14 @@
+import dataclasses
+import os
 import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from itertools import chain, product
 from pathlib import Path
+from random import Random
+
+import pytest
 
 EXAMPLE = """
 467..114..
@@ -84,16 +91,18 @@ def find_gear_adjacent(field, nums):
     return gear_adjacent
 
 
+def gear_index(gear_adjacent):
+    index = defaultdict(list)
+    for num, gears in gear_adjacent:
+        for gear in sorted(gears):
+            index[gear].append(num)
+    return index
+
+
 def find_gear_pairs(field, gear_adjacent):
-    for i in range(len(gear_adjacent)-1):
-        num_i, gears_i = gear_adjacent[i]
-        peers = []
-        for j in range(i+1, len(gear_adjacent)):
-            num_j, gears_j = gear_adjacent[j]
-            if set(gears_i) & set(gears_j):
-                peers.append(num_j)
-        if len(peers) == 1:
-            yield (num_i.val, peers[0].val)
+    for nums in gear_index(gear_adjacent).values():
+        if len(nums) == 2:
+            yield (nums[0].val, nums[1].val)
 
 
 def all_gear_pairs(field):
@@ -108,6 +117,15 @@ def test_all_gear_pairs():
     assert list(gear_pairs) == [(467, 35), (755, 598)]
 
 
+def test_all_gear_pairs_exactly_two():
+    field = [
+        "1.2.3",
+        ".*.*.",
+        "4....",
+    ]
+    assert list(all_gear_pairs(field)) == [(2, 3)]
+
+
 def part2(lines):
     return sum(x * y for x, y in all_gear_pairs(lines))
 
@@ -116,6 +134,339 @@ def test_part2():
     assert part2(EXAMPLE) == 467835
 
 
+def row_numbers(row):
+    return [
+        (m.start(), m.end(), int(m.group(0)))
+        for m in re.finditer(r'\d+', row)
+    ]
+
+
+def decide_row(above, row, below):
+    # everything about a row's numbers and gears is known once the rows
+    # on either side of it have been read
+    text, nums = row
+    part_sum = 0
+    for s_x, e_x, val in nums:
+        left = max(s_x - 1, 0)
+        edges = (
+            above[0][left:e_x + 1] + text[left:s_x] + text[e_x:e_x + 1]
+            + below[0][left:e_x + 1]
+        )
+        if edges.strip('.'):
+            part_sum += val
+
+    gear_sum = 0
+    for m in re.finditer(r'\*', text):
+        x = m.start()
+        vals = [
+            val
+            for _, row_nums in (above, row, below)
+            for s_x, e_x, val in row_nums
+            if s_x - 1 <= x <= e_x
+        ]
+        if len(vals) == 2:
+            gear_sum += vals[0] * vals[1]
+    return part_sum, gear_sum
+
+
+def stream_schematic(lines):
+    empty = ('', [])
+    rows = (
+        (line, row_numbers(line))
+        for line in (line.rstrip('\n') for line in lines)
+    )
+    above, row = empty, next(rows, None)
+    if row is None:
+        return
+    for below in chain(rows, [empty]):
+        yield decide_row(above, row, below)
+        above, row = row, below
+
+
+def stream_totals(lines):
+    part_total = gear_total = 0
+    for part_sum, gear_sum in stream_schematic(lines):
+        part_total += part_sum
+        gear_total += gear_sum
+    return part_total, gear_total
+
+
+def test_stream_totals():
+    assert stream_totals(EXAMPLE) == (part1(EXAMPLE), part2(EXAMPLE))
+    assert stream_totals(line + '\n' for line in EXAMPLE) == (4361, 467835)
+
+
+def test_stream_schematic_rows():
+    assert list(stream_schematic(EXAMPLE)) == [
+        (467, 0),
+        (0, 16345),
+        (35 + 633, 0),
+        (0, 0),
+        (617, 0),
+        (0, 0),
+        (592, 0),
+        (755, 0),
+        (0, 451490),
+        (664 + 598, 0),
+    ]
+
+
+def band_totals(above, band, below):
+    rows = [(line, row_numbers(line)) for line in [above, *band, below]]
+    part_total = gear_total = 0
+    for i in range(1, len(rows) - 1):
+        part_sum, gear_sum = decide_row(*rows[i - 1:i + 2])
+        part_total += part_sum
+        gear_total += gear_sum
+    return part_total, gear_total
+
+
+def parallel_totals(lines, max_workers=None, band_size=None):
+    # each band is sent with the row above and below it so its own rows
+    # can be decided; numbers and gears belong to the row they're on,
+    # so nothing on a band edge is counted twice
+    max_workers = max_workers or os.cpu_count() or 1
+    if band_size is None:
+        band_size = max(-(-len(lines) // (max_workers * 4)), 1)
+    starts = range(0, len(lines), band_size)
+    aboves = [lines[start - 1] if start else '' for start in starts]
+    bands = [lines[start:start + band_size] for start in starts]
+    belows = [
+        lines[start + band_size] if start + band_size < len(lines) else ''
+        for start in starts
+    ]
+    with ProcessPoolExecutor(max_workers) as executor:
+        totals = list(executor.map(band_totals, aboves, bands, belows))
+    return sum(p for p, _ in totals), sum(g for _, g in totals)
+
+
+@pytest.mark.parametrize("band_size", [1, 2, 3, 100])
+def test_parallel_totals(band_size):
+    assert parallel_totals(EXAMPLE, 2, band_size) == (4361, 467835)
+
+
+def cell_mask(grid, chars):
+    # one byte per cell, 1 where the cell is one of chars
+    table = bytes(c in chars for c in range(256))
+    return int.from_bytes(grid.translate(table), 'big')
+
+
+DIGIT_BYTES = b'0123456789'
+SYMBOL_BYTES = bytes(set(range(256)) - set(DIGIT_BYTES + b'.'))
+
+
+def mask_totals(lines):
+    if not lines:
+        return 0, 0
+    # every row gets a trailing '.' so shifting a mask by one cell
+    # never carries it into the neighbouring row
+    width = len(lines[0]) + 1
+    grid = b''.join(line.encode() + b'.' for line in lines)
+    row = 8 * width
+
+    def spread(mask):
+        return mask | (mask << 8) | (mask >> 8)
+
+    def dilate(mask):
+        mask = spread(mask)
+        return mask | (mask << row) | (mask >> row)
+
+    digits = cell_mask(grid, DIGIT_BYTES)
+
+    def runs(seed):
+        seed &= digits
+        while (grown := spread(seed) & digits) != seed:
+            seed = grown
+        return seed
+
+    grid_val = int.from_bytes(grid, 'big')
+
+    def numbers(mask):
+        selected = (grid_val & (mask * 0xFF)).to_bytes(len(grid), 'big')
+        return re.finditer(rb'\d+', selected)
+
+    # part1 treats any cell other than '.' as a symbol, which includes
+    # digits of numbers in the rows above and below
+    parts = runs(
+        dilate(cell_mask(grid, SYMBOL_BYTES))
+        | spread((digits << row) | (digits >> row))
+    )
+    part_sum = sum(int(m.group(0)) for m in numbers(parts))
+
+    gear_adjacent = defaultdict(list)
+    for m in numbers(runs(dilate(cell_mask(grid, b'*')))):
+        y, s_x = divmod(m.start(), width)
+        val = int(m.group(0))
+        for ny in range(max(y - 1, 0), min(y + 2, len(lines))):
+            start = ny * width + max(s_x - 1, 0)
+            stop = ny * width + s_x + len(m.group(0)) + 1
+            while (gear := grid.find(b'*', start, stop)) != -1:
+                gear_adjacent[gear].append(val)
+                start = gear + 1
+    gear_sum = sum(
+        vals[0] * vals[1] for vals in gear_adjacent.values() if len(vals) == 2
+    )
+    return part_sum, gear_sum
+
+
+def test_mask_totals():
+    assert mask_totals(EXAMPLE) == (part1(EXAMPLE), part2(EXAMPLE))
+
+
+@pytest.mark.parametrize("rows", [
+    [],
+    ["12", "34"],
+    ["1.", ".2"],
+    ["1*", "*2"],
+    ["*..", "..5", "..*"],
+    ["3*3", "...", "..."],
+    ["5..", "...", "..5"],
+])
+def test_mask_totals_edges(rows):
+    assert mask_totals(rows) == (part1(rows), part2(rows))
+
+
+@dataclass
+class Schematic:
+    rows: list[list[str]]
+    # part number value by (y, s_x), and ratio by (x, y) for gears
+    # with exactly two numbers
+    parts: dict[tuple[int, int], int] = dataclasses.field(
+        default_factory=dict
+    )
+    gears: dict[tuple[int, int], int] = dataclasses.field(
+        default_factory=dict
+    )
+    part_sum: int = 0
+    gear_sum: int = 0
+
+    @classmethod
+    def from_lines(cls, lines):
+        schematic = cls([list(line) for line in lines])
+        for y, row in enumerate(schematic.rows):
+            schematic.add_numbers(y, schematic.numbers_near(0, len(row), y))
+            schematic.add_gears(range(len(row)), [y])
+        return schematic
+
+    def cell(self, x, y):
+        if 0 <= y < len(self.rows) and 0 <= x < len(self.rows[y]):
+            return self.rows[y][x]
+        return '.'
+
+    def numbers_near(self, x0, x1, y):
+        # the numbers on row y with a digit in columns x0 to x1
+        nums = []
+        x = max(x0, 0)
+        while x <= x1:
+            if not self.cell(x, y).isdigit():
+                x += 1
+                continue
+            s_x = x
+            while self.cell(s_x - 1, y).isdigit():
+                s_x -= 1
+            e_x = x
+            while self.cell(e_x, y).isdigit():
+                e_x += 1
+            nums.append((s_x, e_x, int(''.join(self.rows[y][s_x:e_x]))))
+            x = e_x
+        return nums
+
+    def is_part(self, s_x, e_x, y):
+        return any(
+            self.cell(x, ny) != '.'
+            for ny in (y - 1, y + 1)
+            for x in range(s_x - 1, e_x + 1)
+        ) or self.cell(s_x - 1, y) != '.' or self.cell(e_x, y) != '.'
+
+    def gear_ratio(self, x, y):
+        vals = [
+            val
+            for ny in (y - 1, y, y + 1)
+            for _, _, val in self.numbers_near(x - 1, x + 1, ny)
+        ]
+        return vals[0] * vals[1] if len(vals) == 2 else 0
+
+    def add_numbers(self, y, nums):
+        for s_x, e_x, val in nums:
+            if self.is_part(s_x, e_x, y):
+                self.parts[(y, s_x)] = val
+                self.part_sum += val
+
+    def add_gears(self, xs, ys):
+        for y in ys:
+            for x in xs:
+                if self.cell(x, y) == '*' and (ratio := self.gear_ratio(x, y)):
+                    self.gears[(x, y)] = ratio
+                    self.gear_sum += ratio
+
+    def remove_numbers(self, y, nums):
+        for s_x, _, _ in nums:
+            self.part_sum -= self.parts.pop((y, s_x), 0)
+
+    def remove_gears(self, xs, ys):
+        for y in ys:
+            for x in xs:
+                self.gear_sum -= self.gears.pop((x, y), 0)
+
+    def set_cell(self, x, y, ch):
+        if not (0 <= y < len(self.rows) and 0 <= x < len(self.rows[y])):
+            raise IndexError((x, y))
+        # only numbers touching the 3x3 block around (x, y) can change
+        # their part status, and only gears next to the numbers on row
+        # y can change their ratio
+        ys = range(y - 1, y + 2)
+        old = [self.numbers_near(x - 1, x + 1, ny) for ny in ys]
+        self.rows[y][x] = ch
+        new = [self.numbers_near(x - 1, x + 1, ny) for ny in ys]
+
+        for ny, old_nums, new_nums in zip(ys, old, new):
+            self.remove_numbers(ny, old_nums)
+            self.add_numbers(ny, new_nums)
+
+        spans = [(x - 1, x + 1)] + [
+            (s_x - 1, e_x) for s_x, e_x, _ in old[1] + new[1]
+        ]
+        xs = range(min(lo for lo, _ in spans), max(hi for _, hi in spans) + 1)
+        self.remove_gears(xs, ys)
+        self.add_gears(xs, ys)
+
+
+def test_schematic():
+    schematic = Schematic.from_lines(EXAMPLE)
+    assert (schematic.part_sum, schematic.gear_sum) == (4361, 467835)
+    # the '*' between 467 and 35 stops being a gear and a symbol
+    schematic.set_cell(3, 1, '.')
+    assert (schematic.part_sum, schematic.gear_sum) == (4361 - 467 - 35,
+                                                        451490)
+    # as another symbol it makes both part numbers again, but not a gear
+    schematic.set_cell(3, 1, '#')
+    assert (schematic.part_sum, schematic.gear_sum) == (4361, 451490)
+
+
+@pytest.mark.parametrize("x,y", [(-2, 0), (0, -1), (10, 0), (0, 10)])
+def test_schematic_set_cell_bounds(x, y):
+    schematic = Schematic.from_lines(EXAMPLE)
+    with pytest.raises(IndexError):
+        schematic.set_cell(x, y, '#')
+    assert (schematic.part_sum, schematic.gear_sum) == (4361, 467835)
+    assert [''.join(row) for row in schematic.rows] == EXAMPLE
+
+
+def test_schematic_edits():
+    rng = Random(3)
+    lines = [list(line) for line in EXAMPLE]
+    schematic = Schematic.from_lines(EXAMPLE)
+    for _ in range(500):
+        x, y = rng.randrange(len(lines[0])), rng.randrange(len(lines))
+        ch = rng.choice('..........0123456789*#')
+        lines[y][x] = ch
+        schematic.set_cell(x, y, ch)
+        rows = [''.join(row) for row in lines]
+        assert (schematic.part_sum, schematic.gear_sum) == (
+            part1(rows), part2(rows)
+        )
+
+
 if __name__ == '__main__':
     lines = Path("inputs/day03.txt").read_text().splitlines()
     print(part1(lines))
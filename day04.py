@@ -1,7 +1,12 @@
 import re
+from array import array
 from dataclasses import dataclass
+from itertools import cycle, islice, repeat
+from operator import and_, lshift, or_, rshift
 from pathlib import Path
 
+import pytest
+
 EXAMPLE = """
 Card 1: 41 48 83 86 17 | 83 86  6 31 17  9 48 53
 Card 2: 13 32 20 16 61 | 61 30 68 82 17 32 24 19
@@ -49,10 +54,40 @@ def test_wins():
     ]
 
 
+def number_mask(numbers):
+    mask = 0
+    for n in numbers:
+        mask |= 1 << int(n)
+    return mask
+
+
+@dataclass(frozen=True, slots=True)
+class BitCard:
+    num: int
+    winning: int
+    have: int
+    matches: int
+
+    @classmethod
+    def parse(cls, line):
+        m = Card._PARSER.match(line)
+        winning = number_mask(m.group('winning').split())
+        have = number_mask(m.group('card').split())
+        return cls(int(m.group('num')), winning, have,
+                   (winning & have).bit_count())
+
+
+def test_bit_card():
+    cards = [BitCard.parse(line) for line in EXAMPLE]
+    assert [c.matches for c in cards] == [
+        len(Card.parse(line).wins()) for line in EXAMPLE
+    ]
+    assert cards[3].winning & cards[3].have == 1 << 84
+
+
 def part1(lines):
-    cards = [Card.parse(line) for line in lines]
-    wins = [c.wins() for c in cards]
-    points = [2**(len(win)-1) if win else 0 for win in wins]
+    cards = [BitCard.parse(line) for line in lines]
+    points = [1 << (c.matches - 1) if c.matches else 0 for c in cards]
     return sum(points)
 
 
@@ -65,16 +100,37 @@ if __name__ == '__main__':
     print(part1(lines))
 
 
-def card_count(lines):
-    cards = [Card.parse(line) for line in lines]
-    counts = dict.fromkeys([c.num for c in cards], 1)
-    for card in cards:
-        start = card.num + 1
-        for i in range(start, start + len(card.wins())):
-            counts[i] += counts[card.num]
+def cascade_counts(matches):
+    # each card adds its count to the next `matches` cards; record that
+    # as a +count where the span starts and a -count where it ends, and
+    # keep a running total of those edges
+    matches = list(matches)
+    edges = [0] * (len(matches) + 1)
+    counts = []
+    copies = 0
+    for i, won in enumerate(matches):
+        copies += edges[i]
+        count = copies + 1
+        counts.append(count)
+        if won:
+            edges[i + 1] += count
+            edges[min(i + 1 + won, len(matches))] -= count
     return counts
 
 
+def test_cascade_counts():
+    assert cascade_counts([4, 2, 2, 1, 0, 0]) == [1, 2, 4, 8, 14, 1]
+    assert cascade_counts([10**9, 10**9, 0]) == [1, 2, 4]
+    assert cascade_counts([1] * 200)[-1] == 200
+    assert cascade_counts(range(200, 0, -1))[-1] == 2**199
+
+
+def card_count(lines):
+    cards = [BitCard.parse(line) for line in lines]
+    counts = cascade_counts(c.matches for c in cards)
+    return dict(zip((c.num for c in cards), counts))
+
+
 def test_card_count():
     assert card_count(EXAMPLE) == {
         1: 1,
@@ -86,8 +142,137 @@ def test_card_count():
     }
 
 
+def stream_card_counts(cards, span):
+    # like cascade_counts, but the edges live in a ring buffer: a card
+    # can only reach `span` cards ahead, so slots are reused once read
+    edges = [0] * (span + 1)
+    copies = total = 0
+    for i, card in enumerate(cards):
+        if card.matches > span:
+            raise ValueError(card)
+        slot = i % len(edges)
+        copies += edges[slot]
+        edges[slot] = 0
+        count = copies + 1
+        total += count
+        if card.matches:
+            edges[(i + 1) % len(edges)] += count
+            edges[(i + 1 + card.matches) % len(edges)] -= count
+        yield card.num, count, total
+
+
+def test_stream_card_counts():
+    cards = (BitCard.parse(line) for line in EXAMPLE)
+    assert list(stream_card_counts(cards, 5)) == [
+        (1, 1, 1),
+        (2, 2, 3),
+        (3, 4, 7),
+        (4, 8, 15),
+        (5, 14, 29),
+        (6, 1, 30),
+    ]
+
+
+def test_stream_card_counts_endless():
+    matches = [4, 0, 5, 1, 3, 0, 2, 5, 0, 0, 1]
+    cards = (BitCard(i, 0, 0, m) for i, m in enumerate(cycle(matches), 1))
+    streamed = islice(stream_card_counts(cards, 5), 1000)
+    expected = cascade_counts(islice(cycle(matches), 1005))[:1000]
+    assert [count for _, count, _ in streamed] == expected
+
+
+def test_stream_card_counts_span():
+    with pytest.raises(ValueError):
+        list(stream_card_counts([BitCard(1, 0, 0, 6)], 5))
+
+
 def part2(lines):
-    return sum(card_count(lines).values())
+    return sum(cascade_counts(BitCard.parse(line).matches for line in lines))
+
+
+def test_part2():
+    assert part2(EXAMPLE) == 30
+
+
+def parse_columns(text):
+    # every card has the same number of winning and owned numbers, so
+    # the whitespace-separated tokens form fixed-width rows:
+    # 'Card', 'N:', winning..., '|', owned...
+    first = re.search(r'\S.*', text)
+    if first is None:
+        return [], []
+    winning, _, have = first.group(0).partition(':')[2].partition('|')
+    n_winning, n_have = len(winning.split()), len(have.split())
+    stride = 3 + n_winning + n_have
+    tokens = text.split()
+    if (
+        len(tokens) % stride
+        or set(tokens[::stride]) != {'Card'}
+        or set(tokens[2 + n_winning::stride]) != {'|'}
+    ):
+        raise ValueError("cards don't all share the first card's layout")
+    winning = [
+        array('q', map(int, tokens[2 + i::stride])) for i in range(n_winning)
+    ]
+    have = [
+        array('q', map(int, tokens[3 + n_winning + i::stride]))
+        for i in range(n_have)
+    ]
+    return winning, have
+
+
+def column_masks(columns, size):
+    masks = [0] * size
+    for column in columns:
+        masks = list(map(or_, masks, map(lshift, repeat(1), column)))
+    return masks
+
+
+def bulk_matches(winning, have):
+    size = len((winning or have or [()])[0])
+    return list(map(
+        int.bit_count,
+        map(and_, column_masks(winning, size), column_masks(have, size)),
+    ))
+
+
+def test_bulk_matches():
+    matches = bulk_matches(*parse_columns('\n'.join(EXAMPLE)))
+    assert matches == [4, 2, 2, 1, 0, 0]
+    assert bulk_matches(*parse_columns('\n\n' + '\n'.join(EXAMPLE))) == matches
+    assert bulk_matches(*parse_columns('')) == []
+
+
+def test_bulk_matches_duplicates():
+    line = 'Card 1: 5 5 | 5 7'
+    assert bulk_matches(*parse_columns(line)) == [BitCard.parse(line).matches]
+    assert BitCard.parse(line).matches == len(Card.parse(line).wins()) == 1
+
+
+@pytest.mark.parametrize("text", [
+    'Card 1: 1 2 | 3 4\nCard 2: 1 2 3 | 4',
+    'Card 1: 1 2 | 3 4\nCard 2: 1 2 | 3 4 5',
+    'Card 1: 1 2 | 3 4\nCard 2: 1 2 | 3',
+])
+def test_parse_columns_ragged(text):
+    with pytest.raises(ValueError):
+        parse_columns(text)
+
+
+def part1_bulk(text):
+    matches = bulk_matches(*parse_columns(text))
+    # 1 << m >> 1 is 2**(m-1), or 0 when there are no matches
+    return sum(map(rshift, map(lshift, repeat(1), matches), repeat(1)))
+
+
+def part2_bulk(text):
+    return sum(cascade_counts(bulk_matches(*parse_columns(text))))
+
+
+def test_bulk_parts():
+    text = '\n'.join(EXAMPLE)
+    assert part1_bulk(text) == part1(EXAMPLE) == 13
+    assert part2_bulk(text) == part2(EXAMPLE) == 30
 
 
 if __name__ == '__main__':
@@ -1,6 +1,12 @@
+import mmap
 import re
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass
+from itertools import repeat
+from operator import add, sub
 from pathlib import Path
+from random import Random
 
 import pytest
 
@@ -66,12 +72,88 @@ class Mapping:
 
 
 def convert(mappings, num):
+    if isinstance(mappings, Piecewise):
+        return mappings(num)
     return next(
         (c for m in mappings if (c := m.convert(num)) is not None),
         num,
     )
 
 
+@dataclass
+class Piecewise:
+    # adds offsets[i] to every number from starts[i] up to starts[i+1]
+    # (or without limit, for the last piece); starts[0] is always 0
+    starts: list[int]
+    offsets: list[int]
+
+    @classmethod
+    def from_pieces(cls, pieces):
+        starts, offsets = [], []
+        for start, offset in pieces:
+            # a later piece at the same start replaces an empty one
+            if starts and starts[-1] == start:
+                starts.pop()
+                offsets.pop()
+            if not offsets or offsets[-1] != offset:
+                starts.append(start)
+                offsets.append(offset)
+        return cls(starts, offsets)
+
+    @classmethod
+    def from_mappings(cls, mappings):
+        pieces = []
+        end = 0
+        for m in sorted(mappings, key=lambda m: m.src.start):
+            if m.src.start > end:
+                pieces.append((end, 0))
+            pieces.append((m.src.start, m.dst.start - m.src.start))
+            end = m.src.stop
+        pieces.append((end, 0))
+        return cls.from_pieces(pieces)
+
+    @classmethod
+    def compose(cls, all_mappings):
+        composed = cls([0], [0])
+        for mappings in all_mappings.values():
+            composed = composed.then(cls.from_mappings(mappings))
+        return composed
+
+    def piece(self, num):
+        return bisect_right(self.starts, num) - 1
+
+    def __call__(self, num):
+        return num + self.offsets[self.piece(num)]
+
+    def stop(self, i):
+        return self.starts[i + 1] if i + 1 < len(self.starts) else None
+
+    def then(self, other):
+        # each piece's image is split wherever it crosses one of the
+        # other function's breakpoints
+        pieces = []
+        for i, (start, offset) in enumerate(zip(self.starts, self.offsets)):
+            stop = self.stop(i)
+            j = other.piece(start + offset)
+            pieces.append((start, offset + other.offsets[j]))
+            for j in range(j + 1, len(other.starts)):
+                if stop is not None and other.starts[j] >= stop + offset:
+                    break
+                pieces.append((other.starts[j] - offset,
+                               offset + other.offsets[j]))
+        return self.from_pieces(pieces)
+
+    def map_range(self, r):
+        i = self.piece(r.start)
+        start = r.start
+        while start < r.stop:
+            stop = self.stop(i)
+            stop = r.stop if stop is None else min(stop, r.stop)
+            yield range(start + self.offsets[i], stop + self.offsets[i])
+            start = stop
+            i += 1
+
+
 def parse_maps(line_iter):
     all_mappings = {}
     for line in line_iter:
@@ -118,6 +200,21 @@ def parse(lines):
 def test_convert(seed, soil):
     ranges = parse_maps(iter(EXAMPLE[2:5]))['seed-to-soil']
     assert convert(ranges, seed) == soil
+    assert convert(Piecewise.from_mappings(ranges), seed) == soil
+
+
+def test_piecewise_from_mappings():
+    ranges = parse_maps(iter(EXAMPLE[2:5]))['seed-to-soil']
+    stage = Piecewise.from_mappings(ranges)
+    assert stage == Piecewise([0, 50, 98, 100], [0, 2, -48, 0])
+    assert [stage(seed) for seed in (79, 14, 55, 13)] == [81, 14, 57, 13]
+
+
+def index_stages(all_mappings):
+    return {
+        name: Piecewise.from_mappings(mappings)
+        for name, mappings in all_mappings.items()
+    }
 
 
 def seed_to_location(all_mappings, seed):
@@ -136,11 +233,13 @@ def seed_to_location(all_mappings, seed):
 def test_seed_to_location(seed, loc):
     _, all_mappings = parse(EXAMPLE)
     assert seed_to_location(all_mappings, seed) == loc
+    assert seed_to_location(index_stages(all_mappings), seed) == loc
 
 
 def part1(lines):
     seeds, all_mappings = parse(lines)
-    locations = [seed_to_location(all_mappings, seed) for seed in seeds]
+    stages = index_stages(all_mappings)
+    locations = [seed_to_location(stages, seed) for seed in seeds]
     return min(locations)
 
 
@@ -165,6 +264,61 @@ def part2_slow(lines):
     return min(locations)
 
 
+def map_chunk(stages, seeds):
+    nums = seeds
+    for stage in stages:
+        pieces = map(sub, map(bisect_right, repeat(stage.starts), nums),
+                     repeat(1))
+        nums = array('q', map(add, nums, map(stage.offsets.__getitem__,
+                                             pieces)))
+    return nums
+
+
+def write_locations(stages, seed_ranges, path, chunk_size=1 << 20):
+    # locations are written in seed order as native int64s
+    stages = list(stages)
+    total = sum(len(r) for r in seed_ranges)
+    itemsize = array('q').itemsize
+    with open(path, 'w+b') as f:
+        f.truncate(total * itemsize)
+        if not total:
+            return 0
+        with mmap.mmap(f.fileno(), 0) as out:
+            pos = 0
+            for seed_range in seed_ranges:
+                for start in range(seed_range.start, seed_range.stop,
+                                   chunk_size):
+                    chunk = range(start,
+                                  min(start + chunk_size, seed_range.stop))
+                    locations = map_chunk(stages, chunk).tobytes()
+                    out[pos:pos + len(locations)] = locations
+                    pos += len(locations)
+    return total
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 20])
+def test_write_locations(tmp_path, chunk_size):
+    seeds, all_mappings = parse(EXAMPLE)
+    seed_ranges = [
+        range(start, start + length)
+        for start, length in zip(seeds[::2], seeds[1::2])
+    ]
+    stages = index_stages(all_mappings).values()
+    path = tmp_path / "locations"
+    assert write_locations(stages, seed_ranges, path, chunk_size) == 27
+    locations = array('q', path.read_bytes())
+    assert list(locations) == [
+        seed_to_location(all_mappings, seed)
+        for seed_range in seed_ranges
+        for seed in seed_range
+    ]
+    assert min(locations) == 46
+
+    composed = [Piecewise.compose(all_mappings)]
+    write_locations(composed, seed_ranges, path, chunk_size)
+    assert array('q', path.read_bytes()) == locations
+
+
 def overlap(a, b):
     #   ____      ____
     #  |    |    |    |
@@ -245,6 +399,9 @@ def convert_range(mapping, r):
 
 
 def convert_ranges(mappings, irange):
+    if isinstance(mappings, Piecewise):
+        yield from mappings.map_range(irange)
+        return
     for m in mappings:
         converted = convert_range(m, irange)
         if converted:
@@ -253,20 +410,200 @@ def convert_ranges(mappings, irange):
     yield from [irange]
 
 
+def test_convert_ranges_index():
+    ranges = parse_maps(iter(EXAMPLE[2:5]))['seed-to-soil']
+    stage = Piecewise.from_mappings(ranges)
+    assert list(convert_ranges(stage, range(45, 105))) == [
+        range(45, 50),
+        range(52, 100),
+        range(50, 52),
+        range(100, 105),
+    ]
+
+
+@dataclass
+class RangeSet:
+    # sorted, non-empty, and neither overlapping nor touching
+    ranges: list[range]
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        coalesced = []
+        for r in sorted((r for r in ranges if r), key=lambda r: r.start):
+            if coalesced and r.start <= coalesced[-1].stop:
+                last = coalesced.pop()
+                r = range(last.start, max(last.stop, r.stop))
+            coalesced.append(r)
+        return cls(coalesced)
+
+    def through(self, stage):
+        # both the ranges and the stage's pieces are sorted, so one
+        # sweep splits every range against every piece it touches
+        pieces = []
+        i = 0
+        for r in self.ranges:
+            start = r.start
+            while start < r.stop:
+                while (stop := stage.stop(i)) is not None and stop <= start:
+                    i += 1
+                stop = r.stop if stop is None else min(stop, r.stop)
+                offset = stage.offsets[i]
+                pieces.append(range(start + offset, stop + offset))
+                start = stop
+        return self.from_ranges(pieces)
+
+    def min(self):
+        return self.ranges[0].start
+
+    def first_in(self, start, stop=None):
+        # the lowest number in the set that's at least start and, when
+        # stop is given, less than stop
+        i = bisect_right(self.ranges, start, key=lambda r: r.stop)
+        if i == len(self.ranges):
+            return None
+        first = max(start, self.ranges[i].start)
+        return first if stop is None or first < stop else None
+
+
+def test_range_set_from_ranges():
+    ranges = [range(5, 10), range(0, 3), range(3, 5), range(20, 20),
+              range(12, 15), range(13, 14)]
+    assert RangeSet.from_ranges(ranges).ranges == [range(0, 10),
+                                                   range(12, 15)]
+
+
+def test_range_set_through():
+    ranges = parse_maps(iter(EXAMPLE[2:5]))['seed-to-soil']
+    stage = Piecewise.from_mappings(ranges)
+    mapped = RangeSet.from_ranges([range(45, 105), range(0, 10)])
+    assert mapped.through(stage).ranges == [range(0, 10), range(45, 105)]
+    mapped = RangeSet.from_ranges([range(49, 51), range(97, 99)])
+    assert mapped.through(stage).ranges == [range(49, 51), range(52, 53),
+                                            range(99, 100)]
+
+
 def part_2(lines):
     seeds, all_mappings = parse(lines)
-    ranges = [
-        range(int(start), int(start) + int(stop))
-        for start, stop in zip(seeds[::2], seeds[1::2])
-    ]
-    for mappings in all_mappings.values():
-        ranges = [c for r in ranges for c in convert_ranges(mappings, r)]
-    return min(r[0] for r in ranges)
+    ranges = RangeSet.from_ranges(
+        range(start, start + length)
+        for start, length in zip(seeds[::2], seeds[1::2])
+    )
+    for stage in index_stages(all_mappings).values():
+        ranges = ranges.through(stage)
+    return ranges.min()
 
 
 def test_part2():
     assert part_2(EXAMPLE) == 46
 
 
+ADVERSARIAL = """
+seeds: 5 10 40 3
+
+seed-to-soil map:
+100 5 3
+200 10 2
+
+soil-to-location map:
+0 200 2
+""".strip().splitlines()
+
+
+def part2_reverse(lines):
+    # walk the composed almanac's pieces from the lowest location they
+    # can produce upwards; pieces' images may overlap, so keep going
+    # until no later piece can start below the best location found
+    seeds, all_mappings = parse(lines)
+    seed_set = RangeSet.from_ranges(
+        range(start, start + length)
+        for start, length in zip(seeds[::2], seeds[1::2])
+    )
+    composed = Piecewise.compose(all_mappings)
+    pieces = sorted(
+        (start + offset, start, composed.stop(i), offset)
+        for i, (start, offset) in enumerate(zip(composed.starts,
+                                                composed.offsets))
+    )
+    best = None
+    for lowest, start, stop, offset in pieces:
+        if best is not None and lowest >= best:
+            break
+        if (seed := seed_set.first_in(start, stop)) is not None:
+            best = seed + offset if best is None else min(best, seed + offset)
+    return best
+
+
+def test_part2_reverse():
+    assert part2_reverse(EXAMPLE) == part_2(EXAMPLE) == 46
+    assert part2_reverse(ADVERSARIAL) == part_2(ADVERSARIAL) == 0
+
+
+def test_part2_reverse_random():
+    rng = Random(5)
+    for _ in range(50):
+        lines = ["seeds: " + " ".join(
+            str(rng.randrange(0, 100)) for _ in range(2 * rng.randrange(1, 6))
+        ), ""]
+        for stage in ("seed-to-soil", "soil-to-location"):
+            lines.append(f"{stage} map:")
+            for _ in range(rng.randrange(0, 5)):
+                lines.append(f"{rng.randrange(0, 100)} "
+                             f"{rng.randrange(0, 100)} {rng.randrange(0, 20)}")
+            lines.append("")
+        lines.pop()
+        seeds, all_mappings = parse(lines)
+        seeds = [
+            seed
+            for start, length in zip(seeds[::2], seeds[1::2])
+            for seed in range(start, start + length)
+        ]
+        if not seeds:
+            continue
+        # overlapping source ranges in a stage are ambiguous
+        if any(
+            len({n for m in mappings for n in m.src})
+            != sum(len(m.src) for m in mappings)
+            for mappings in all_mappings.values()
+        ):
+            continue
+        expected = min(seed_to_location(all_mappings, s) for s in seeds)
+        assert part2_reverse(lines) == part_2(lines) == expected
+
+
+def test_part2_adversarial():
+    seeds, all_mappings = parse(ADVERSARIAL)
+    expected = min(
+        seed_to_location(all_mappings, seed)
+        for start, length in zip(seeds[::2], seeds[1::2])
+        for seed in range(start, start + length)
+    )
+    assert expected == 0
+    assert part_2(ADVERSARIAL) == expected
+
+
+def test_piecewise_compose():
+    _, all_mappings = parse(EXAMPLE)
+    composed = Piecewise.compose(all_mappings)
+    for seed in range(120):
+        assert composed(seed) == seed_to_location(all_mappings, seed)
+    for r in [range(79, 93), range(55, 68), range(0, 120), range(5, 6)]:
+        mapped = [n for m in composed.map_range(r) for n in m]
+        assert mapped == [seed_to_location(all_mappings, s) for s in r]
+
+
+def part2_composed(lines):
+    seeds, all_mappings = parse(lines)
+    composed = Piecewise.compose(all_mappings)
+    return min(
+        mapped.start
+        for start, length in zip(seeds[::2], seeds[1::2])
+        for mapped in composed.map_range(range(start, start + length))
+    )
+
+
+def test_part2_composed():
+    assert part2_composed(EXAMPLE) == 46
+
+
 if __name__ == '__main__':
     print(part_2(lines))
@@ -1,8 +1,12 @@
 from dataclasses import dataclass
 from functools import reduce
-from operator import mul
+from itertools import repeat
+from math import isqrt
+from operator import floordiv, mul, ne, sub
 from pathlib import Path
 
+import pytest
+
 EXAMPLE = """
 Time:      7  15   30
 Distance:  9  40  200
@@ -58,10 +62,106 @@ def test_ways_to_win():
     assert ways_to_win(race) == 4
 
 
+def first_winning_hold(time, distance):
+    # hold * (time - hold) > distance is hold**2 - time*hold + distance < 0,
+    # which is true strictly between the roots of
+    # (time +/- sqrt(time**2 - 4*distance)) / 2. isqrt lands within one
+    # of the lower root, so nudge it onto the first winning hold.
+    disc = time * time - 4 * distance
+    if disc < 0:
+        return None
+    hold = max((time - isqrt(disc)) // 2, 0)
+    while hold > 0 and (hold - 1) * (time - hold + 1) > distance:
+        hold -= 1
+    while hold * (time - hold) <= distance:
+        hold += 1
+        if 2 * hold > time:
+            return None
+    return hold
+
+
+def product_tree(nums):
+    # multiply neighbours pairwise until one number is left; a left fold
+    # multiplies an ever-growing product by each small number, which is
+    # quadratic in the product's size
+    nums = list(nums)
+    if not nums:
+        return 1
+    while len(nums) > 1:
+        pairs = list(map(mul, nums[::2], nums[1::2]))
+        if len(nums) % 2:
+            pairs.append(nums[-1])
+        nums = pairs
+    return nums[0]
+
+
+def test_product_tree():
+    assert product_tree([]) == 1
+    assert product_tree([5]) == 5
+    assert product_tree(range(1, 30)) == reduce(mul, range(1, 30))
+
+
+def batch_ways_to_win(times, distances):
+    # the closed form over whole columns: the first winning hold is
+    # floor(lower root) + 1, and floor(lower root) is (time - s) // 2
+    # when disc is a perfect square s**2, or (time - s - 1) // 2 when
+    # sqrt(disc) lies strictly between s and s + 1. a race with disc <= 0
+    # comes out with a count <= 0, which is clamped to no ways to win.
+    times = list(times)
+    discs = list(map(
+        max,
+        map(sub, map(mul, times, times), map(mul, distances, repeat(4))),
+        repeat(0),
+    ))
+    roots = list(map(isqrt, discs))
+    inexact = map(ne, map(mul, roots, roots), discs)
+    lower = map(floordiv, map(sub, map(sub, times, roots), inexact),
+                repeat(2))
+    counts = list(map(
+        max,
+        map(sub, map(sub, times, map(mul, lower, repeat(2))), repeat(1)),
+        repeat(0),
+    ))
+    return counts, product_tree(counts)
+
+
+def test_batch_ways_to_win():
+    assert batch_ways_to_win([7, 15, 30], [9, 40, 200]) == ([4, 8, 9], 288)
+    assert batch_ways_to_win([7, 4], [9, 4]) == ([4, 0], 0)
+    assert batch_ways_to_win([2**70, 2**70], [0, 2**138 - 1]) == (
+        [2**70 - 1, 1], 2**70 - 1
+    )
+
+
+def test_batch_ways_to_win_boundaries():
+    times, distances = zip(*(
+        (time, distance)
+        for time in range(0, 40)
+        for distance in range(0, time * time // 4 + 2)
+    ))
+    counts, _ = batch_ways_to_win(times, distances)
+    for time, distance, count in zip(times, distances, counts):
+        first_hold = first_winning_hold(time, distance)
+        assert count == (
+            0 if first_hold is None else time - 2 * first_hold + 1
+        )
+
+
+def test_batch_ways_to_win_many():
+    # big enough that folding the product left to right takes seconds
+    size = 200_000
+    counts, product = batch_ways_to_win([7] * size, [9] * size)
+    assert counts == [4] * size
+    assert product == 1 << (2 * size)
+
+
 def part1(lines):
     races = parse_races(lines)
-    wins = [ways_to_win(race) for race in races]
-    return reduce(mul, wins)
+    _, product = batch_ways_to_win(
+        [race.time for race in races],
+        [race.distance for race in races],
+    )
+    return product
 
 
 def test_part1():
@@ -89,10 +189,7 @@ def test_parse_race():
 
 
 def fast_ways_to_win(race):
-    first_hold = None
-    for first_hold in range(race.time//2):
-        if first_hold * (race.time - first_hold) > race.distance:
-            break
+    first_hold = first_winning_hold(race.time, race.distance)
     if first_hold is None:
         raise ValueError(race)
     last_hold = race.time - first_hold
@@ -105,6 +202,28 @@ def test_fast_ways_to_win():
         assert fast_ways_to_win(race) == ways_to_win(race)
 
 
+@pytest.mark.parametrize("time", range(1, 40))
+def test_fast_ways_to_win_boundaries(time):
+    best = (time // 2) * (time - time // 2)
+    for distance in range(0, best + 1):
+        race = Race(time=time, distance=distance)
+        if distance == best:
+            with pytest.raises(ValueError):
+                fast_ways_to_win(race)
+        else:
+            assert fast_ways_to_win(race) == ways_to_win(race)
+
+
+def test_fast_ways_to_win_huge():
+    time = 10**40 + 7
+    distance = 10**79
+    first_hold = first_winning_hold(time, distance)
+    assert first_hold * (time - first_hold) > distance
+    assert (first_hold - 1) * (time - first_hold + 1) <= distance
+    race = Race(time=time, distance=distance)
+    assert fast_ways_to_win(race) == time - 2 * first_hold + 1
+
+
 def part2(lines):
     race = parse_race(lines)
     ways = fast_ways_to_win(race)
@@ -1,8 +1,12 @@
-from collections import Counter
+import json
+from array import array
+from collections import Counter, deque
 from dataclasses import dataclass, field, replace
 from enum import Enum
-from functools import total_ordering
+from functools import cache, total_ordering
+from operator import attrgetter
 from pathlib import Path
+from random import Random
 
 import pytest
 
@@ -20,28 +24,107 @@ class HandType(Enum):
     FIVE_OF_A_KIND = Counter([5])
 
 
-@dataclass
+def count_partitions(total, largest=None):
+    # every way of writing total as a descending tuple of card counts
+    if total == 0:
+        yield ()
+        return
+    for first in range(min(total, largest or total), 0, -1):
+        for rest in count_partitions(total - first, first):
+            yield (first,) + rest
+
+
+def build_hand_type_table():
+    table = {}
+    for jokers in range(6):
+        for counts in count_partitions(5 - jokers):
+            with_jokers = counts + ((jokers,) if jokers else ())
+            upgraded = (
+                (counts[0] + jokers,) + counts[1:] if counts else (jokers,)
+            )
+            table[counts, jokers] = (
+                HandType(Counter(with_jokers)),
+                HandType(Counter(upgraded)),
+            )
+    return table
+
+
+@cache
+def hand_type_table(path=None):
+    # maps (descending counts of the non-joker cards, number of jokers)
+    # to the hand's normal type and its type with jokers wild; if path
+    # is given the table is read from there, or written there once built
+    if path is not None and Path(path).exists():
+        return {
+            (tuple(counts), jokers): (HandType[normal], HandType[wild])
+            for counts, jokers, normal, wild in json.loads(
+                Path(path).read_text()
+            )
+        }
+    table = build_hand_type_table()
+    if path is not None:
+        Path(path).write_text(json.dumps([
+            [counts, jokers, normal.name, wild.name]
+            for (counts, jokers), (normal, wild) in table.items()
+        ]))
+    return table
+
+
+def hand_signature(cards):
+    jokers = cards.count('J')
+    counts = sorted(map(cards.count, set(cards) - {'J'}), reverse=True)
+    return tuple(counts), jokers
+
+
+def classify(cards):
+    return hand_type_table()[hand_signature(cards)]
+
+
+def test_hand_type_table(tmp_path):
+    table = build_hand_type_table()
+    assert len(table) == 7 + 5 + 3 + 2 + 1 + 1
+    assert table[(2, 1), 2] == (HandType.TWO_PAIR, HandType.FOUR_OF_A_KIND)
+    assert table[(3,), 2] == (HandType.FULL_HOUSE, HandType.FIVE_OF_A_KIND)
+    assert table[(), 5] == (HandType.FIVE_OF_A_KIND, HandType.FIVE_OF_A_KIND)
+    path = tmp_path / "hand_types.json"
+    assert hand_type_table(path) == table
+    assert path.exists()
+    assert hand_type_table.__wrapped__(path) == table
+
+
+HAND_TYPE_RANKS = {hand_type: i for i, hand_type in enumerate(HandType)}
+
+
+def hand_key(hand_type, cards, ranks):
+    # the type, then each card's rank, as the digits of a base 13 number
+    key = HAND_TYPE_RANKS[hand_type]
+    for c in cards:
+        key = key * len(ranks) + ranks.index(c)
+    return key
+
+
+@dataclass(slots=True)
 @total_ordering
 class Hand:
     cards: str
-    counts: Counter[int, int]
+    # the hand's signature: descending non-joker card counts and the
+    # number of jokers (see hand_signature)
+    counts: tuple[tuple[int, ...], int]
     type: HandType
     ranks: str = field(default=CARD_RANKS)
+    key: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.key = hand_key(self.type, self.cards, self.ranks)
 
     @classmethod
     def from_cards(cls, cards):
-        spread = Counter(cards)
-        counts = Counter(spread.values())
-        return cls(cards, counts, HandType(counts))
+        signature = hand_signature(cards)
+        hand_type, _ = hand_type_table()[signature]
+        return cls(cards, signature, hand_type)
 
     def __lt__(self, other):
-        return (
-            list(HandType).index(self.type),
-            [self.ranks.index(c) for c in self.cards],
-        ) < (
-            list(HandType).index(other.type),
-            [self.ranks.index(c) for c in other.cards]
-        )
+        return self.key < other.key
 
 
 EXAMPLE_HANDS = {
@@ -90,6 +173,22 @@ def sort_cards(weaker, stronger, type):
     assert sorted([stronger, weaker]) == [weaker, stronger]
 
 
+def test_hand_counts_are_not_shared():
+    hand = Hand.from_cards('KK677')
+    assert hand.counts == ((2, 2, 1), 0)
+    assert hand.counts is not HandType.TWO_PAIR.value
+    assert HandType.TWO_PAIR.value == Counter([2, 2, 1])
+
+
+def test_hand_key():
+    hand = Hand.from_cards('T55J5')
+    assert hand.key == int('83393', 13) + 3 * 13**5
+    assert replace(hand, ranks=JOKER_CARD_RANKS).key == (
+        int('94404', 13) + 3 * 13**5
+    )
+    assert not hasattr(hand, '__dict__')
+
+
 EXAMPLE = """
 32T3K 765
 T55J5 684
@@ -111,7 +210,7 @@ def parse_hands_and_bids(lines):
 def rank_and_bid(cards_to_bids, hands):
     return [
         (hand.cards, i, cards_to_bids[hand.cards])
-        for i, hand in enumerate(sorted(hands), 1)
+        for i, hand in enumerate(sorted(hands, key=attrgetter('key')), 1)
     ]
 
 
@@ -151,13 +250,8 @@ if __name__ == '__main__':
 
 
 def jokers_high_type(hand):
-    without_jokers = Counter(hand.cards.replace('J', ''))
-    if not without_jokers:
-        # nice
-        return HandType.FIVE_OF_A_KIND
-    [(most_common, _)] = without_jokers.most_common(1)
-    new_cards = hand.cards.replace('J', most_common)
-    return Hand.from_cards(new_cards).type
+    _, wild_type = classify(hand.cards)
+    return wild_type
 
 
 @pytest.mark.parametrize("cards,high_type", [
@@ -190,5 +284,183 @@ def test_part2():
     assert part2(EXAMPLE) == 5905
 
 
+def hand_columns(lines, wild=False):
+    ranks = JOKER_CARD_RANKS if wild else CARD_RANKS
+    keys = array('q')
+    bids = array('q')
+    for line in lines:
+        cards, bid = line.split()
+        normal_type, wild_type = classify(cards)
+        keys.append(hand_key(wild_type if wild else normal_type, cards, ranks))
+        bids.append(int(bid))
+    return keys, bids
+
+
+def radix_order(keys, digits=6, base=13):
+    # least significant digit first; each pass is stable, so equal
+    # hands keep their input order
+    order = range(len(keys))
+    for place in range(digits):
+        div = base ** place
+        buckets = [[] for _ in range(base)]
+        for i in order:
+            buckets[keys[i] // div % base].append(i)
+        order = [i for bucket in buckets for i in bucket]
+    return order
+
+
+def columnar_winnings(lines, wild=False):
+    keys, bids = hand_columns(lines, wild)
+    return sum(
+        rank * bids[i] for rank, i in enumerate(radix_order(keys), 1)
+    )
+
+
+def test_columnar_winnings():
+    assert columnar_winnings(EXAMPLE) == part1(EXAMPLE)
+    assert columnar_winnings(EXAMPLE, wild=True) == part2(EXAMPLE)
+
+
+def test_columnar_winnings_duplicates():
+    lines = EXAMPLE + ['KK677 100', '32T3K 1']
+    # the weakest two hands are both 32T3K; duplicates rank separately
+    # in input order
+    keys, bids = hand_columns(lines)
+    assert radix_order(keys) == [0, 6, 3, 2, 5, 1, 4]
+    assert columnar_winnings(lines) == sum(
+        rank * bid for rank, bid in enumerate(
+            [765, 1, 220, 28, 100, 684, 483], 1
+        )
+    )
+
+
+@dataclass
+class Fenwick:
+    size: int
+    # only the nodes that have been touched are stored, so memory grows
+    # with the entries added rather than with size
+    tree: dict[int, int] = field(default_factory=dict)
+
+    @classmethod
+    def of_size(cls, size):
+        return cls(size)
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.size:
+            self.tree[i] = self.tree.get(i, 0) + delta
+            i += i & -i
+
+    def prefix(self, i):
+        # the sum of the entries before i
+        total = 0
+        while i > 0:
+            total += self.tree.get(i, 0)
+            i &= i - 1
+        return total
+
+
+KEY_SPACE = len(HandType) * len(CARD_RANKS) ** 5
+
+
+@dataclass
+class HandBook:
+    wild: bool = False
+    # hand counts and bid sums, indexed by hand key
+    counts: Fenwick = field(default_factory=lambda: Fenwick.of_size(KEY_SPACE))
+    bid_sums: Fenwick = field(
+        default_factory=lambda: Fenwick.of_size(KEY_SPACE)
+    )
+    # bids for each hand in the order they were added; copies of a hand
+    # are ranked in that order
+    bids: dict[str, deque[int]] = field(default_factory=dict)
+    total_bids: int = 0
+    winnings: int = 0
+
+    def key(self, cards):
+        normal_type, wild_type = classify(cards)
+        if self.wild:
+            return hand_key(wild_type, cards, JOKER_CARD_RANKS)
+        return hand_key(normal_type, cards, CARD_RANKS)
+
+    def add(self, cards, bid):
+        key = self.key(cards)
+        # the new hand goes after every hand at or below its key and
+        # pushes every hand above it up a rank
+        rank = self.counts.prefix(key + 1) + 1
+        above = self.total_bids - self.bid_sums.prefix(key + 1)
+        self.winnings += rank * bid + above
+        self.counts.add(key, 1)
+        self.bid_sums.add(key, bid)
+        self.total_bids += bid
+        self.bids.setdefault(cards, deque()).append(bid)
+
+    def remove(self, cards):
+        bids = self.bids[cards]
+        bid = bids.popleft()
+        if not bids:
+            del self.bids[cards]
+        key = self.key(cards)
+        # the oldest copy goes, so every hand from its key up (other
+        # than itself) drops a rank
+        rank = self.counts.prefix(key) + 1
+        later = self.total_bids - self.bid_sums.prefix(key) - bid
+        self.winnings -= rank * bid + later
+        self.counts.add(key, -1)
+        self.bid_sums.add(key, -bid)
+        self.total_bids -= bid
+
+    def total_winnings(self):
+        return self.winnings
+
+
+@pytest.mark.parametrize("wild,expected", [(False, 6440), (True, 5905)])
+def test_hand_book(wild, expected):
+    book = HandBook(wild)
+    for line in EXAMPLE:
+        cards, bid = line.split()
+        book.add(cards, int(bid))
+    assert book.total_winnings() == expected
+    book.remove('KK677')
+    assert book.total_winnings() == winnings(
+        [line for line in EXAMPLE if not line.startswith('KK677')],
+        jokerfy_hands if wild else None,
+    )
+    with pytest.raises(KeyError):
+        book.remove('KK677')
+
+
+def test_hand_book_empty_is_small():
+    book = HandBook()
+    assert book.counts.tree == {}
+    assert book.bid_sums.tree == {}
+    book.add('KK677', 28)
+    # one path up the tree per Fenwick, not one slot per possible key
+    assert len(book.counts.tree) <= KEY_SPACE.bit_length()
+    book.remove('KK677')
+    assert book.total_winnings() == 0
+
+
+@pytest.mark.parametrize("wild", [False, True])
+def test_hand_book_edits(wild):
+    rng = Random(7)
+    book = HandBook(wild)
+    entries = []
+    for _ in range(300):
+        if entries and rng.random() < 0.4:
+            cards, _ = rng.choice(entries)
+            book.remove(cards)
+            entries.remove(next(e for e in entries if e[0] == cards))
+        else:
+            cards = ''.join(rng.choice('2TJQA') for _ in range(5))
+            bid = rng.randrange(1, 1000)
+            book.add(cards, bid)
+            entries.append((cards, bid))
+        ranked = sorted(entries, key=lambda e: book.key(e[0]))
+        assert book.total_winnings() == sum(
+            rank * bid for rank, (_, bid) in enumerate(ranked, 1)
+        )
+
+
 if __name__ == '__main__':
     print(part2(lines))